@@ -1,19 +1,94 @@
-from fastapi import FastAPI, HTTPException, Header, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Header, BackgroundTasks, Depends
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict
-import requests
 import datetime
+import time
 import random
+import re
+import orjson
+import os
+import uuid
+from collections import deque
+from weakref import WeakValueDictionary
+from contextlib import asynccontextmanager
+import asyncio
+import ahocorasick
+import httpx
+import redis.asyncio as redis
+from redis.exceptions import LockError
+from cachetools import TTLCache
 
-app = FastAPI(title="Agentic Honey-Pot API")
+app = FastAPI(title="Agentic Honey-Pot API", default_response_class=ORJSONResponse)
 
 # --- Configuration ---
-VALID_API_KEYS = ["sk_test_123456789"]
+VALID_API_KEYS = frozenset({"sk_test_123456789"})
 CALLBACK_URL = "https://hackathon.guvi.in/api/updateHoneyPotFinalResult"
 
-# --- In-Memory Database (Replace with Redis/DB in prod) ---
-# Format: {session_id: {"history": [], "metadata": {}, "scam_detected": False}}
-sessions: Dict[str, Dict] = {}
+# Optional endpoint accepting a JSON array of callback payloads
+CALLBACK_BATCH_URL = os.getenv("CALLBACK_BATCH_URL")
+CALLBACK_CONCURRENCY = 50
+
+# Durable callback queue (Redis 6.2+ for BLMOVE): jobs move from CALLBACK_QUEUE
+# to this process's `callbacks:processing:{worker_id}` list while in flight and
+# land in CALLBACK_DEAD after CALLBACK_MAX_RETRIES failed attempts. Each process
+# keeps `callbacks:heartbeat:{worker_id}` alive; once it lapses, any other
+# process moves that worker's in-flight jobs back to CALLBACK_QUEUE.
+CALLBACK_QUEUE = "callbacks"
+CALLBACK_PROCESSING = "callbacks:processing"
+CALLBACK_HEARTBEAT = "callbacks:heartbeat"
+CALLBACK_OWNERS = "callbacks:owners"
+CALLBACK_DEAD = "callbacks:dead"
+CALLBACK_HEARTBEAT_TTL_SECONDS = 30
+CALLBACK_HEARTBEAT_INTERVAL_SECONDS = 10
+CALLBACK_MAX_RETRIES = 5
+CALLBACK_WORKERS = int(os.getenv("CALLBACK_WORKERS", "8"))
+# Identifies this process's processing list and heartbeat
+_WORKER_ID = uuid.uuid4().hex
+
+# Shared across callbacks so connections stay warm; created on startup
+http_client: Optional[httpx.AsyncClient] = None
+
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_TTL_SECONDS = 86400
+# Upper bound on sessions held by the in-memory store
+SESSION_MAX_COUNT = 100_000
+# Eviction counter is logged at most this often
+EVICTION_LOG_INTERVAL_SECONDS = 60
+# Messages kept per session; total_count still counts every message
+HISTORY_MAX_LEN = 64
+
+# --- Session Store ---
+# With REDIS_URL set, sessions live in Redis so every worker shares them and idle
+# ones expire. Layout: hash `sess:{sid}` (scam_detected "0"/"1", metadata JSON,
+# total_count) plus list `sess:{sid}:history` of the last HISTORY_MAX_LEN
+# JSON-encoded messages.
+# Run Redis with `maxmemory 512mb` and `maxmemory-policy allkeys-lru`.
+redis_client = redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+class _SessionCache(TTLCache):
+    """
+    TTLCache that counts sessions dropped because the store is full and logs the
+    count at most once per EVICTION_LOG_INTERVAL_SECONDS.
+    """
+    evictions = 0
+    _last_eviction_log = 0.0
+
+    def popitem(self):
+        sid, session = super().popitem()
+        self.evictions += 1
+        now = time.monotonic()
+        if now - self._last_eviction_log >= EVICTION_LOG_INTERVAL_SECONDS:
+            self._last_eviction_log = now
+            print(f"Session store full; {self.evictions} sessions evicted so far")
+        return sid, session
+
+# In-memory fallback for local runs (single worker only). Idle sessions expire
+# after SESSION_TTL_SECONDS and the least recently used one (read or written) is evicted once
+# SESSION_MAX_COUNT is reached; an evicted session restarts with
+# scam_detected=False if the scammer comes back.
+# Format: {session_id: {"history": deque(maxlen=HISTORY_MAX_LEN), "metadata": {}, "scam_detected": False, "total_count": 0}}
+sessions: TTLCache = _SessionCache(maxsize=SESSION_MAX_COUNT, ttl=SESSION_TTL_SECONDS)
 
 # --- Models ---
 class MessageRequest(BaseModel):
@@ -38,38 +113,91 @@ class CallbackPayload(BaseModel):
     extractedIntelligence: Dict
     agentNotes: str
 
+# --- Helpers ---
+def validate_api_key(x_api_key: str = Header(...)):
+    if x_api_key not in VALID_API_KEYS:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+    return x_api_key
+
+# [epoch seconds, formatted] of the last timestamp handed out
+_last_ts = [0.0, ""]
+
+def now_iso() -> str:
+    """
+    Local-time ISO timestamp, reused for calls within 1 ms of each other.
+    """
+    t = time.time()
+    if abs(t - _last_ts[0]) > 0.001:  # abs: wall clock can step backwards
+        _last_ts[0] = t
+        _last_ts[1] = datetime.datetime.fromtimestamp(t).isoformat()
+    return _last_ts[1]
+
 # --- Logic (Rule-Based for "No API Key" Scenario) ---
 
 SCAM_KEYWORDS = ["bank", "verify", "block", "suspend", "upi", "urgent", "pan card", "kyc", "expired"]
 
-def detect_scam(text: str) -> bool:
-    text_lower = text.lower()
-    return any(keyword in text_lower for keyword in SCAM_KEYWORDS)
+# Built once at import: one linear scan per text instead of one `in` per keyword.
+_AC = ahocorasick.Automaton()
+for _kw in SCAM_KEYWORDS:
+    _AC.add_word(_kw, _kw)
+_AC.make_automaton()
 
-def generate_agent_reply(last_scammer_text: str, session_data: Dict) -> str:
+def detect_scam(text_lower: str) -> bool:
+    """
+    Expects already lowercased text (see chat_handler).
+    """
+    return next(_AC.iter(text_lower), None) is not None
+
+# Trigger keyword -> reply, in priority order when a message matches several.
+# Every trigger must also be in SCAM_KEYWORDS so _AC can find it.
+_REPLY_BY_KW = {
+    "verify": "I don't know how to verify. Can you help me?",
+    "bank": "Oh no! My bank account? What happened?",
+    "upi": "I send money using GPay normally. Is that UPI?"
+}
+
+FALLBACK_REPLIES = (
+    "I am confused.",
+    "Please tell me what to do.",
+    "Is this official?",
+    "I am getting scared."
+)
+
+def generate_agent_reply(text_lower: str, history_len: int) -> str:
     """
     Simulates a naive victim to keep the scammer engaged.
+    Expects the scammer's last message already lowercased and the length of the
+    client-supplied conversationHistory.
     """
-    history_len = len(session_data.get("conversationHistory", []))
-    
     if history_len < 2:
         return "Who is this? Why are you messaging me?"
-    elif "verify" in last_scammer_text.lower():
-        return "I don't know how to verify. Can you help me?"
-    elif "bank" in last_scammer_text.lower():
-        return "Oh no! My bank account? What happened?"
-    elif "upi" in last_scammer_text.lower():
-        return "I send money using GPay normally. Is that UPI?"
-    else:
-        replies = [
-            "I am confused.",
-            "Please tell me what to do.",
-            "Is this official?",
-            "I am getting scared."
-        ]
-        return random.choice(replies)
-
-def extract_intelligence(history: List[MessageRequest]) -> Dict:
+
+    matched = {kw for _, kw in _AC.iter(text_lower)}
+    for kw, reply in _REPLY_BY_KW.items():
+        if kw in matched:
+            return reply
+    return random.choice(FALLBACK_REPLIES)
+
+# Links, UPI IDs and phone numbers in one pass. URLs come first in the
+# alternation so digits or "@" inside a link aren't reported separately.
+# Phones are exactly 10 digits (optional country code, single space/hyphen
+# separators, same line), so card/account numbers and dates don't match.
+# UPI IDs only start at a token boundary, which keeps finditer linear on long
+# words without an "@".
+_INTEL_RE = re.compile(
+    r"(https?://\S+)"
+    r"|((?<![A-Za-z0-9_.+-])[A-Za-z0-9_.+-]+@[A-Za-z0-9_.-]*[A-Za-z0-9])"
+    r"|((?<!\d)(?:\+\d{1,3}[ -]?)?\d(?:[ -]?\d){9}(?!\d))"
+)
+# Sentence punctuation that \S+ swallows at the end of a link
+_LINK_TRAILING_PUNCT = ".,;:!?)"
+# Only the start of each message is scanned; this runs on the event loop
+INTEL_SCAN_MAX_CHARS = 4096
+
+def extract_intelligence(history: List[Dict]) -> Dict:
+    """
+    Expects messages as plain dicts (as stored in the session), not models.
+    """
     # Heuristic extraction
     intel = {
         "bankAccounts": [],
@@ -78,113 +206,451 @@ def extract_intelligence(history: List[MessageRequest]) -> Dict:
         "phoneNumbers": [],
         "suspiciousKeywords": []
     }
+    # Dedupe in sets while scanning, serialize to lists once at the end
+    links_set = set()
+    upi_set = set()
+    phone_set = set()
+    kw_set = set()
     for msg in history:
-        if msg.sender == "user": continue # Skip our own messages
+        if msg["sender"] == "user": continue # Skip our own messages
         
-        text = msg.text
-        # Naive extraction logic
-        if "http" in text:
-            intel["phishingLinks"].append(text.split("http")[1].split(" ")[0])
-        if "@" in text and "upi" not in intel["upiIds"]: # weak check for upi
-             words = text.split()
-             for w in words:
-                 if "@" in w: intel["upiIds"].append(w)
+        text = msg["text"][:INTEL_SCAN_MAX_CHARS]
+        for m in _INTEL_RE.finditer(text):
+            link, upi, phone = m.groups()
+            if link:
+                links_set.add(link.rstrip(_LINK_TRAILING_PUNCT))
+            elif upi:
+                upi_set.add(upi)
+            else:
+                phone_set.add(phone)
         
         # Check keywords
-        for kw in SCAM_KEYWORDS:
-            if kw in text.lower() and kw not in intel["suspiciousKeywords"]:
-                intel["suspiciousKeywords"].append(kw)
-                
+        for _, kw in _AC.iter(text.lower()):
+            kw_set.add(kw)
+
+    intel["phishingLinks"] = list(links_set)
+    intel["upiIds"] = list(upi_set)
+    intel["phoneNumbers"] = list(phone_set)
+    intel["suspiciousKeywords"] = list(kw_set)
     return intel
 
-async def send_callback(session_id: str, session_data: Dict):
+def _session_key(sid: str) -> str:
+    return f"sess:{sid}"
+
+def _history_key(sid: str) -> str:
+    return f"sess:{sid}:history"
+
+async def append_message(sid: str, message: Dict, metadata: Optional[Dict] = None, scam_detected: bool = False) -> Dict:
+    """
+    Appends a message to the session, creating it if needed, in one round-trip.
+    Returns {"scam_detected": bool, "total_count": int} after the write.
+    """
+    if redis_client is None:
+        session = sessions.get(sid)
+        if session is None:
+            session = {
+                "history": deque(maxlen=HISTORY_MAX_LEN),
+                "metadata": metadata or {},
+                "scam_detected": False,
+                "total_count": 0
+            }
+        session["history"].append(message)
+        session["total_count"] += 1
+        if scam_detected:
+            session["scam_detected"] = True
+        # Re-assign on every write so the TTL counts from the last message
+        sessions[sid] = session
+        return {"scam_detected": session["scam_detected"], "total_count": session["total_count"]}
+
+    key, history_key = _session_key(sid), _history_key(sid)
+    pipe = redis_client.pipeline()
+    pipe.hsetnx(key, "metadata", orjson.dumps(metadata or {}))
+    if scam_detected:
+        pipe.hset(key, "scam_detected", "1")
+    else:
+        pipe.hsetnx(key, "scam_detected", "0")
+    pipe.rpush(history_key, orjson.dumps(message))
+    pipe.ltrim(history_key, -HISTORY_MAX_LEN, -1)
+    pipe.hincrby(key, "total_count", 1)
+    pipe.hget(key, "scam_detected")
+    pipe.expire(key, SESSION_TTL_SECONDS)
+    pipe.expire(history_key, SESSION_TTL_SECONDS)
+    _, _, _, _, total_count, flag, _, _ = await pipe.execute()
+    return {"scam_detected": flag == "1", "total_count": total_count}
+
+# Per-session locks for the in-memory store; entries vanish once no request holds them
+_session_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+# How long a request waits for a busy session before getting a 503
+SESSION_LOCK_WAIT_SECONDS = 5
+# Redis lock lease. The locked section is a few pipelined round-trips (well
+# under a second); the lease only has to outlive a stalled one.
+SESSION_LOCK_LEASE_SECONDS = 30
+
+@asynccontextmanager
+async def _session_lock(sid: str):
+    """
+    Serializes chat_handler's read-modify-write of one session. Uses a Redis lock
+    (SET NX PX) when sessions live in Redis so it holds across workers.
+    """
+    if redis_client is None:
+        lock = _session_locks.get(sid)
+        if lock is None:
+            lock = _session_locks[sid] = asyncio.Lock()
+        async with lock:
+            yield
+        return
+
+    lock = redis_client.lock(
+        f"lock:{_session_key(sid)}",
+        timeout=SESSION_LOCK_LEASE_SECONDS,
+        blocking_timeout=SESSION_LOCK_WAIT_SECONDS
+    )
+    if not await lock.acquire():
+        raise HTTPException(status_code=503, detail="Session busy, retry shortly", headers={"Retry-After": "1"})
+    try:
+        yield
+    finally:
+        try:
+            await lock.release()
+        except LockError as e:
+            # Lease ran out before we finished; the work itself is done, so don't fail the request
+            print(f"Session lock for {sid} expired before release: {e}")
+
+async def load_session(sid: str) -> Optional[Dict]:
+    """
+    Returns {"history": deque, "metadata": {...}, "scam_detected": bool, "total_count": int} or None.
+    """
+    if redis_client is None:
+        return sessions.get(sid)
+
+    pipe = redis_client.pipeline()
+    pipe.hgetall(_session_key(sid))
+    pipe.lrange(_history_key(sid), 0, -1)
+    fields, history = await pipe.execute()
+    if not fields:
+        return None
+    return {
+        "history": deque((orjson.loads(m) for m in history), maxlen=HISTORY_MAX_LEN),
+        "metadata": orjson.loads(fields.get("metadata", "{}")),
+        "scam_detected": fields.get("scam_detected") == "1",
+        "total_count": int(fields.get("total_count", len(history)))
+    }
+
+class CallbackBatcher:
+    """
+    Coalesces callbacks submitted within `max_wait_ms` (up to `max_batch`) and
+    POSTs them as one JSON array to CALLBACK_BATCH_URL. Without a batch endpoint
+    each payload is POSTed to CALLBACK_URL, at most CALLBACK_CONCURRENCY at once.
+    """
+    def __init__(self, max_batch: int = 16, max_wait_ms: int = 50):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flushes = set()
+
+    def start(self):
+        # Created here rather than in __init__ so they bind to the server's loop
+        self._queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(CALLBACK_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def submit(self, payload: Dict):
+        """
+        Waits until the payload has been delivered; raises if the POST failed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((payload, future))
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Flush in the background so the next window starts collecting right away
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List):
+        if CALLBACK_BATCH_URL:
+            await self._post(CALLBACK_BATCH_URL, [payload for payload, _ in batch], [f for _, f in batch])
+        else:
+            await asyncio.gather(*(self._post(CALLBACK_URL, payload, [f]) for payload, f in batch))
+
+    async def _post(self, url: str, body, futures: List[asyncio.Future]):
+        try:
+            async with self._semaphore:
+                response = await http_client.post(
+                    url,
+                    content=orjson.dumps(body),
+                    headers={"Content-Type": "application/json"}
+                )
+            response.raise_for_status()
+        except Exception as e:
+            for f in futures:
+                if not f.done():
+                    f.set_exception(e)
+        else:
+            for f in futures:
+                if not f.done():
+                    f.set_result(None)
+
+callback_batcher = CallbackBatcher()
+_callback_workers: List[asyncio.Task] = []
+
+async def send_callback(session_id: str):
     """
     Sends the final report to the hackathon evaluation endpoint.
     """
-    history = session_data["history"]
-    intel = extract_intelligence([MessageRequest(**m) if isinstance(m, dict) else m for m in history])
+    session_data = await load_session(session_id)
+    if session_data is None:
+        return
+    intel = extract_intelligence(list(session_data["history"]))
     
     payload = {
         "sessionId": session_id,
         "scamDetected": session_data["scam_detected"],
-        "totalMessagesExchanged": len(history),
+        "totalMessagesExchanged": session_data["total_count"],
         "extractedIntelligence": intel,
         "agentNotes": "Rule-based agent detected scam keywords and engaged."
     }
     
-    # In a real run, we would POST this.
-    # checking if we should actually call it or log it
-    print(f"--- MOCK CALLBACK SENDING FOR {session_id} ---")
-    print(payload)
-    # try:
-    #     requests.post(CALLBACK_URL, json=payload, timeout=5)
-    # except Exception as e:
-    #     print(f"Callback failed: {e}")
+    print(f"--- CALLBACK SENDING FOR {session_id} ---")
+    await callback_batcher.submit(payload)
+
+async def _send_callback_logged(session_id: str):
+    try:
+        await send_callback(session_id)
+    except Exception as e:
+        print(f"Callback failed: {e}")
+
+async def enqueue_callback(session_id: str, background_tasks: BackgroundTasks):
+    """
+    Queues the final report. With Redis the job survives restarts and is retried
+    by the callback workers; otherwise it runs once as a background task.
+    """
+    if redis_client is None:
+        background_tasks.add_task(_send_callback_logged, session_id)
+        return
+    job = {"sessionId": session_id, "attempt": 0}
+    await redis_client.lpush(CALLBACK_QUEUE, orjson.dumps(job))
+
+def _processing_key(worker_id: str) -> str:
+    return f"{CALLBACK_PROCESSING}:{worker_id}"
+
+def _heartbeat_key(worker_id: str) -> str:
+    return f"{CALLBACK_HEARTBEAT}:{worker_id}"
+
+async def _settle_job(processing: str, raw: str, target: Optional[str] = None, payload=None):
+    """
+    Removes a job from our processing list, atomically pushing `payload` onto
+    `target` first if given. Retries until Redis accepts it so the job is never
+    stranded in the processing list of a live worker.
+    """
+    while True:
+        try:
+            pipe = redis_client.pipeline()
+            if target is not None:
+                pipe.lpush(target, payload)
+            pipe.lrem(processing, 1, raw)
+            await pipe.execute()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Callback job settle failed, retrying: {e}")
+            await asyncio.sleep(1)
+
+async def _callback_worker():
+    """
+    Delivers queued callbacks, retrying with exponential backoff.
+    """
+    processing = _processing_key(_WORKER_ID)
+    while True:
+        try:
+            raw = await redis_client.blmove(CALLBACK_QUEUE, processing, 0, "RIGHT", "LEFT")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Callback queue read failed: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        try:
+            job = orjson.loads(raw)
+            session_id = job["sessionId"]
+        except Exception as e:
+            print(f"Malformed callback job {raw!r}: {e}")
+            await _settle_job(processing, raw, CALLBACK_DEAD, raw)
+            continue
+
+        try:
+            await send_callback(session_id)
+        except asyncio.CancelledError:
+            # Left in our processing list; reclaimed once our heartbeat lapses
+            raise
+        except Exception as e:
+            job["attempt"] = job.get("attempt", 0) + 1
+            print(f"Callback failed for {session_id} (attempt {job['attempt']}): {e}")
+            if job["attempt"] >= CALLBACK_MAX_RETRIES:
+                target = CALLBACK_DEAD
+            else:
+                await asyncio.sleep(2 ** job["attempt"])
+                target = CALLBACK_QUEUE
+            await _settle_job(processing, raw, target, orjson.dumps(job))
+        else:
+            await _settle_job(processing, raw)
+
+async def _beat():
+    pipe = redis_client.pipeline()
+    pipe.set(_heartbeat_key(_WORKER_ID), "1", ex=CALLBACK_HEARTBEAT_TTL_SECONDS)
+    pipe.sadd(CALLBACK_OWNERS, _WORKER_ID)
+    await pipe.execute()
+
+async def _reclaim_orphaned_callbacks():
+    """
+    Requeues in-flight jobs of processes whose heartbeat has expired.
+    Delivery is at-least-once: a job may be resent if its owner died mid-POST.
+    """
+    for owner in await redis_client.smembers(CALLBACK_OWNERS):
+        if owner == _WORKER_ID or await redis_client.exists(_heartbeat_key(owner)):
+            continue
+        # RPOPLPUSH moves each job atomically, so concurrent reclaimers can't duplicate it
+        while await redis_client.rpoplpush(_processing_key(owner), CALLBACK_QUEUE) is not None:
+            pass
+        await redis_client.srem(CALLBACK_OWNERS, owner)
+
+async def _callback_heartbeat():
+    while True:
+        try:
+            await _beat()
+            await _reclaim_orphaned_callbacks()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Callback heartbeat failed: {e}")
+        await asyncio.sleep(CALLBACK_HEARTBEAT_INTERVAL_SECONDS)
 
 # --- Endpoints ---
 from fastapi import APIRouter
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
+
+@router.on_event("startup")
+async def start_callbacks():
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=5.0,
+        http2=True,
+        limits=httpx.Limits(max_connections=100)
+    )
+    callback_batcher.start()
+    if redis_client is not None:
+        # Register before taking any job so peers never see our list without a heartbeat
+        await _beat()
+        _callback_workers.append(asyncio.create_task(_callback_heartbeat()))
+        _callback_workers.extend(asyncio.create_task(_callback_worker()) for _ in range(CALLBACK_WORKERS))
+
+@router.on_event("shutdown")
+async def close_callbacks():
+    for worker in _callback_workers:
+        worker.cancel()
+    if redis_client is not None:
+        # Let peers reclaim whatever we were delivering right away
+        try:
+            await redis_client.delete(_heartbeat_key(_WORKER_ID))
+        except Exception as e:
+            print(f"Callback heartbeat cleanup failed: {e}")
+    callback_batcher.stop()
+    if http_client is not None:
+        await http_client.aclose()
+
+@router.on_event("shutdown")
+async def close_session_store():
+    if redis_client is not None:
+        await redis_client.aclose()
 
 @router.post("/api/chat", response_model=HoneyPotResponse)
 async def chat_handler(
     request: HoneyPotRequest, 
     background_tasks: BackgroundTasks,
-    x_api_key: str = Header(...)
+    x_api_key: str = Depends(validate_api_key)
 ):
-    if x_api_key not in VALID_API_KEYS:
-        # For simplicity in hackathon, returning success false or HTTP 401
-        raise HTTPException(status_code=401, detail="Invalid API Key")
-
-    # 1. Update Session
     sid = request.sessionId
-    if sid not in sessions:
-        sessions[sid] = {
-            "history": [], 
-            "metadata": request.metadata, 
-            "scam_detected": False
-        }
     
     # Sync history if provided
     if request.conversationHistory:
         # In a real app we might merge, here we heavily rely on the request's history if it's stateless
         pass 
     
-    # Append current message
     current_msg = request.message
-    sessions[sid]["history"].append(current_msg)
 
-    # 2. Detect Scam
-    is_scam = detect_scam(current_msg.text)
-    if is_scam:
-        sessions[sid]["scam_detected"] = True
+    # 1. Detect Scam
+    text_lower = current_msg.text.lower()
+    is_scam = detect_scam(text_lower)
 
-    # 3. Generate Reply
-    if sessions[sid]["scam_detected"]:
-        reply_text = generate_agent_reply(current_msg.text, request.dict())
-        
-        # Add our reply to history
-        our_reply = {
-            "sender": "user",
-            "text": reply_text,
-            "timestamp": datetime.datetime.now().isoformat()
-        }
-        sessions[sid]["history"].append(our_reply)
+    # Steps 2-4 run under the session lock so concurrent messages for the same
+    # session can't interleave their appends or the callback check
+    async with _session_lock(sid):
+        # 2. Update Session (append current message)
+        session = await append_message(sid, current_msg.model_dump(), request.metadata, is_scam)
 
-        
-        # 4. Check if we should end/callback (Simple rule: > 4 messages triggers report)
-        if len(sessions[sid]["history"]) >= 4:
-            background_tasks.add_task(send_callback, sid, sessions[sid])
+        # 3. Generate Reply
+        if session["scam_detected"]:
+            reply_text = generate_agent_reply(text_lower, len(request.conversationHistory or []))
             
-        return HoneyPotResponse(status="success", reply=reply_text)
-    else:
-        # If not scam, be normal or ignore? Problem says "If scam intent is detected... Agent is activated"
-        # If NOT detected, maybe we just say generic greeting or don't reply?
-        # But API must return something.
-        return HoneyPotResponse(status="success", reply="Hello, how can I help you?")
+            # Add our reply to history
+            our_reply = {
+                "sender": "user",
+                "text": reply_text,
+                "timestamp": now_iso()
+            }
+            session = await append_message(sid, our_reply)
+
+            
+            # 4. Check if we should end/callback (Simple rule: > 4 messages triggers report)
+            if session["total_count"] >= 4:
+                await enqueue_callback(sid, background_tasks)
+                
+            return HoneyPotResponse(status="success", reply=reply_text)
+        else:
+            # If not scam, be normal or ignore? Problem says "If scam intent is detected... Agent is activated"
+            # If NOT detected, maybe we just say generic greeting or don't reply?
+            # But API must return something.
+            return HoneyPotResponse(status="success", reply="Hello, how can I help you?")
 
 app.include_router(router)
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Sessions are only shared between workers when they live in Redis.
+    workers = (os.cpu_count() or 1) if REDIS_URL else 1
+    if workers > 1:
+        # Workers import the app by module path; make the repo root importable
+        # for `python honeypot/main.py` as well as `python -m honeypot.main`.
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # loop/http "auto" pick uvloop and httptools when installed (uvloop has no Windows build).
+    uvicorn.run(
+        app if workers == 1 else "honeypot.main:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="auto",
+        http="auto",
+        workers=workers
+    )
@@ -1,8 +1,10 @@
+import os
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from voice_detection.main import router as voice_router
-from honeypot.main import router as honeypot_router
+from honeypot.main import router as honeypot_router, REDIS_URL
 
-app = FastAPI(title="Hackathon Unified API")
+app = FastAPI(title="Hackathon Unified API", default_response_class=ORJSONResponse)
 
 # Include routes from both modules
 # They already define their full paths (/api/voice-detection, /api/chat)
@@ -15,4 +17,16 @@ def home():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Honeypot sessions are only shared between workers when they live in Redis.
+    workers = (os.cpu_count() or 1) if REDIS_URL else 1
+    # loop/http "auto" pick uvloop and httptools when installed (uvloop has no Windows build).
+    # Workers need an import string; a single worker reuses this module's app
+    # instead of importing server.py a second time.
+    uvicorn.run(
+        app if workers == 1 else "server:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=workers
+    )